@@ -1,103 +1,309 @@
+import functools
+import logging
+import threading
+import time
 import boto3
-import json
-from typing import Dict, List, Any
+import orjson
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from collections import defaultdict
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Any, Optional, Tuple
 
-def get_network_resources(event: Dict, context: Any) -> Dict:
+logger = logging.getLogger(__name__)
+
+# EC2 error codes meaning the role may not call an optional describe
+_PERMISSION_ERROR_CODES = ('UnauthorizedOperation', 'AccessDenied')
+
+# Page sizes per describe operation; EC2 caps MaxResults at 1000 for most
+# describes but only 100 for describe_route_tables.
+PAGE_SIZES = {
+    'describe_vpcs': 1000,
+    'describe_subnets': 1000,
+    'describe_route_tables': 100,
+    'describe_security_groups': 1000,
+    'describe_network_interfaces': 1000,
+}
+
+# Keys a route's target can appear under, in lookup order. InstanceId comes
+# before NetworkInterfaceId since instance routes carry both.
+_TARGET_KEYS = (
+    'GatewayId',
+    'NatGatewayId',
+    'TransitGatewayId',
+    'VpcPeeringConnectionId',
+    'InstanceId',
+    'NetworkInterfaceId',
+    'EgressOnlyInternetGatewayId',
+    'CarrierGatewayId',
+    'LocalGatewayId',
+    'CoreNetworkArn',
+)
+
+# Describe results cached across warm Lambda invocations, keyed by
+# (region, operation) and holding (fetched_at, items)
+CACHE_TTL_SECONDS = 60
+_CACHE: Dict[Tuple[str, str], Tuple[float, List[Dict]]] = {}
+
+# Upper bound on regions collected at once in a multi-region sweep
+MAX_REGION_WORKERS = 8
+
+# Room for concurrent describes on one client, with adaptive client-side
+# rate limiting so parallel bursts back off instead of tripping throttles
+CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    tcp_keepalive=True
+)
+
+# Session and clients live at module scope so warm invocations reuse their
+# endpoint resolution and HTTPS connection pools
+_SESSION = boto3.session.Session()
+_SESSION_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=32)
+def _client(region: Optional[str] = None) -> Any:
+    """Return the EC2 client for a region, or the default region if None."""
+    # Creating clients from a shared session is not thread-safe
+    with _SESSION_LOCK:
+        return _SESSION.client('ec2', region_name=region, config=CLIENT_CONFIG)
+
+# Collected resource records; orjson serializes dataclasses natively, so the
+# response body keeps the same JSON shape the diagram generator reads
+@dataclass(slots=True)
+class Subnet:
+    id: str
+    name: str
+    cidr: str
+    az: str
+    public: bool
+
+@dataclass(slots=True)
+class Route:
+    destination: str
+    target: str
+
+@dataclass(slots=True)
+class RouteTable:
+    id: str
+    name: str
+    routes: List[Route]
+    subnet_associations: List[str]
+
+@dataclass(slots=True)
+class IngressRule:
+    protocol: str
+    port_range: str
+    sources: List[str]
+
+@dataclass(slots=True)
+class SecurityGroup:
+    id: str
+    name: str
+    description: str
+    rules_ingress: List[IngressRule]
+    subnets: List[str] = field(default_factory=list)
+
+@dataclass(slots=True)
+class Vpc:
+    id: str
+    name: str
+    cidr: str
+    subnets: List[Subnet] = field(default_factory=list)
+    route_tables: List[RouteTable] = field(default_factory=list)
+    security_groups: List[SecurityGroup] = field(default_factory=list)
+
+def _tag_dict(tags: Optional[List[Dict]]) -> Dict[str, str]:
+    """Convert a boto3 Tags list into a Key -> Value dict."""
+    return {tag['Key']: tag['Value'] for tag in (tags or ())}
+
+def collect_vpcs(ec2: Any) -> List[Vpc]:
     """
-    Collects AWS networking resources and structures them for Mermaid diagram generation.
-    Returns a dictionary with organized network infrastructure data.
+    Collects the networking resources visible to an EC2 client and groups them by VPC.
+    Returns a list of VPCs with their subnets, route tables and security groups.
     """
-    ec2 = boto3.client('ec2')
-    
-    def get_name_tag(tags: List[Dict]) -> str:
-        """Extract Name tag from resource tags."""
-        if not tags:
-            return "Unnamed"
-        return next((tag['Value'] for tag in tags if tag['Key'] == 'Name'), "Unnamed")
-
-    # Collect VPCs
-    vpcs_response = ec2.describe_vpcs()
-    vpcs = []
-    for vpc in vpcs_response['Vpcs']:
-        vpc_data = {
-            'id': vpc['VpcId'],
-            'name': get_name_tag(vpc.get('Tags', [])),
-            'cidr': vpc['CidrBlock'],
-            'subnets': [],
-            'route_tables': [],
-            'security_groups': []
-        }
-        vpcs.append(vpc_data)
-    
-    # Collect Subnets for each VPC
-    for vpc in vpcs:
-        subnets_response = ec2.describe_subnets(
-            Filters=[{'Name': 'vpc-id', 'Values': [vpc['id']]}]
+    def paginate(operation: str, response_key: str) -> Iterator[Dict]:
+        """Yield every item of a describe operation, one page at a time."""
+        paginator = ec2.get_paginator(operation)
+        for page in paginator.paginate(PaginationConfig={'PageSize': PAGE_SIZES[operation]}):
+            yield from page[response_key]
+
+    def describe(operation: str, response_key: str) -> List[Dict]:
+        """Return all items of a describe operation, reusing recent results."""
+        cache_key = (ec2.meta.region_name, operation)
+        cached = _CACHE.get(cache_key)
+        if cached and time.monotonic() - cached[0] < CACHE_TTL_SECONDS:
+            return cached[1]
+        items = list(paginate(operation, response_key))
+        _CACHE[cache_key] = (time.monotonic(), items)
+        return items
+
+    def shape_vpc(vpc: Dict) -> Vpc:
+        return Vpc(
+            id=vpc['VpcId'],
+            name=_tag_dict(vpc.get('Tags')).get('Name', 'Unnamed'),
+            cidr=vpc['CidrBlock']
         )
-        for subnet in subnets_response['Subnets']:
-            subnet_data = {
-                'id': subnet['SubnetId'],
-                'name': get_name_tag(subnet.get('Tags', [])),
-                'cidr': subnet['CidrBlock'],
-                'az': subnet['AvailabilityZone'],
-                'public': subnet.get('MapPublicIpOnLaunch', False)
-            }
-            vpc['subnets'].append(subnet_data)
-    
-    # Collect Route Tables
-    for vpc in vpcs:
-        route_tables_response = ec2.describe_route_tables(
-            Filters=[{'Name': 'vpc-id', 'Values': [vpc['id']]}]
+
+    def shape_subnet(subnet: Dict) -> Subnet:
+        return Subnet(
+            id=subnet['SubnetId'],
+            name=_tag_dict(subnet.get('Tags')).get('Name', 'Unnamed'),
+            cidr=subnet['CidrBlock'],
+            az=subnet['AvailabilityZone'],
+            public=subnet.get('MapPublicIpOnLaunch', False)
         )
-        for rt in route_tables_response['RouteTables']:
-            routes = []
-            for route in rt['Routes']:
-                route_data = {
-                    'destination': route.get('DestinationCidrBlock', 'Unknown'),
-                    'target': next((v for k, v in route.items() if k.endswith('Id')), 'Unknown')
-                }
-                routes.append(route_data)
-            
-            rt_data = {
-                'id': rt['RouteTableId'],
-                'name': get_name_tag(rt.get('Tags', [])),
-                'routes': routes,
-                'subnet_associations': [assoc['SubnetId'] for assoc in rt.get('Associations', []) if 'SubnetId' in assoc]
-            }
-            vpc['route_tables'].append(rt_data)
-    
-    # Collect Security Groups
-    for vpc in vpcs:
-        sg_response = ec2.describe_security_groups(
-            Filters=[{'Name': 'vpc-id', 'Values': [vpc['id']]}]
+
+    def shape_route_table(rt: Dict) -> RouteTable:
+        routes = []
+        for route in rt['Routes']:
+            routes.append(Route(
+                destination=route.get('DestinationCidrBlock', 'Unknown'),
+                target=next((route[k] for k in _TARGET_KEYS if k in route), 'Unknown')
+            ))
+
+        return RouteTable(
+            id=rt['RouteTableId'],
+            name=_tag_dict(rt.get('Tags')).get('Name', 'Unnamed'),
+            routes=routes,
+            subnet_associations=[assoc['SubnetId'] for assoc in rt.get('Associations', []) if 'SubnetId' in assoc]
         )
-        for sg in sg_response['SecurityGroups']:
-            rules_ingress = []
-            for rule in sg['IpPermissions']:
-                port_range = f"{rule.get('FromPort', 'All')}-{rule.get('ToPort', 'All')}"
-                sources = [ip_range['CidrIp'] for ip_range in rule.get('IpRanges', [])]
-                rules_ingress.append({
-                    'protocol': rule.get('IpProtocol', 'All'),
-                    'port_range': port_range,
-                    'sources': sources
-                })
-            
-            sg_data = {
-                'id': sg['GroupId'],
-                'name': sg['GroupName'],
-                'description': sg['Description'],
-                'rules_ingress': rules_ingress
-            }
-            vpc['security_groups'].append(sg_data)
+
+    def shape_security_group(sg: Dict) -> SecurityGroup:
+        rules_ingress = []
+        for rule in sg['IpPermissions']:
+            port_range = f"{rule.get('FromPort', 'All')}-{rule.get('ToPort', 'All')}"
+            sources = [ip_range['CidrIp'] for ip_range in rule.get('IpRanges', [])]
+            rules_ingress.append(IngressRule(
+                protocol=rule.get('IpProtocol', 'All'),
+                port_range=port_range,
+                sources=sources
+            ))
+
+        return SecurityGroup(
+            id=sg['GroupId'],
+            name=sg['GroupName'],
+            description=sg['Description'],
+            rules_ingress=rules_ingress
+        )
+
+    def collect_by_vpc(operation: str, response_key: str, shape) -> Dict[str, List[Any]]:
+        """Bucket the shaped items of a describe operation by VpcId."""
+        by_vpc = defaultdict(list)
+        for item in describe(operation, response_key):
+            by_vpc[item['VpcId']].append(shape(item))
+        return by_vpc
+
+    def collect_subnets_by_sg() -> Dict[str, List[str]]:
+        """Map each security group to the subnets its network interfaces live in."""
+        # SG -> subnet edges are optional enrichment; a role without
+        # ec2:DescribeNetworkInterfaces still gets SG nodes, just no edges
+        try:
+            enis = describe('describe_network_interfaces', 'NetworkInterfaces')
+        except ClientError as e:
+            if e.response['Error']['Code'] not in _PERMISSION_ERROR_CODES:
+                raise
+            logger.warning(
+                'Skipping security group subnet edges: %s', e.response['Error']['Code']
+            )
+            return {}
+
+        by_sg = defaultdict(set)
+        for eni in enis:
+            for group in eni.get('Groups', []):
+                by_sg[group['GroupId']].add(eni['SubnetId'])
+        return {sg_id: sorted(subnet_ids) for sg_id, subnet_ids in by_sg.items()}
+
+    # (Vpc field, describe operation, response key, shaper) for each VPC-scoped collection
+    collectors = [
+        ('subnets', 'describe_subnets', 'Subnets', shape_subnet),
+        ('route_tables', 'describe_route_tables', 'RouteTables', shape_route_table),
+        ('security_groups', 'describe_security_groups', 'SecurityGroups', shape_security_group),
+    ]
+
+    # Collect VPCs, Subnets, Route Tables, Security Groups and Network
+    # Interfaces account-wide, paging through every describe concurrently
+    # since none depends on another. Describe calls on a single client are
+    # safe to issue from multiple threads.
+    with ThreadPoolExecutor(max_workers=len(collectors) + 2) as executor:
+        vpcs_future = executor.submit(
+            lambda: [shape_vpc(vpc) for vpc in describe('describe_vpcs', 'Vpcs')]
+        )
+        sg_subnets_future = executor.submit(collect_subnets_by_sg)
+        futures = {
+            executor.submit(collect_by_vpc, operation, response_key, shape): key
+            for key, operation, response_key, shape in collectors
+        }
+
+        # Attach each bucket to its VPC as the collections complete
+        vpcs = vpcs_future.result()
+        for future in as_completed(futures):
+            key = futures[future]
+            by_vpc = future.result()
+            for vpc in vpcs:
+                setattr(vpc, key, by_vpc.get(vpc.id, []))
+
+        # Link security groups to the subnets they are in use in
+        sg_subnets = sg_subnets_future.result()
+        for vpc in vpcs:
+            for sg in vpc.security_groups:
+                sg.subnets = sg_subnets.get(sg.id, [])
     
-    # Create final structure
-    network_data = {
-        'timestamp': context.aws_request_id,
-        'region': ec2.meta.region_name,
-        'vpcs': vpcs
+    return vpcs
+
+def collect_region(region: str) -> Dict:
+    """Collect networking resources for a single region."""
+    ec2 = _client(region)
+    return {
+        'region': region,
+        'vpcs': collect_vpcs(ec2)
     }
+
+def _requested_regions(event: Any) -> List[str]:
+    """Return the de-duplicated region names requested by event['regions']."""
+    if not isinstance(event, dict):
+        return []
+
+    regions = event.get('regions') or []
+    if isinstance(regions, str):
+        regions = [regions]
+    if not isinstance(regions, list) or not all(isinstance(r, str) for r in regions):
+        raise ValueError("event['regions'] must be a region name or a list of region names")
+
+    # Keep the caller's order while dropping repeats
+    return list(dict.fromkeys(regions))
+
+def get_network_resources(event: Dict, context: Any) -> Dict:
+    """
+    Collects AWS networking resources and structures them for Mermaid diagram generation.
+    Returns a dictionary with organized network infrastructure data.
+
+    Pass a region name or list of region names as event['regions'] to sweep
+    several regions; otherwise the function's own region is collected.
+    """
+    regions = _requested_regions(event)
+
+    if regions:
+        # Regions are independent, so collect them side by side. Threads are
+        # used rather than multiprocessing.Pool, which needs /dev/shm and is
+        # unavailable in the Lambda runtime; the work is I/O-bound either way.
+        with ThreadPoolExecutor(max_workers=min(MAX_REGION_WORKERS, len(regions))) as executor:
+            per_region = list(executor.map(collect_region, regions))
+
+        network_data = {
+            'timestamp': context.aws_request_id,
+            'regions': per_region
+        }
+    else:
+        ec2 = _client()
+        network_data = {
+            'timestamp': context.aws_request_id,
+            'region': ec2.meta.region_name,
+            'vpcs': collect_vpcs(ec2)
+        }
     
     return {
         'statusCode': 200,
-        'body': json.dumps(network_data, default=str)
+        'body': orjson.dumps(network_data).decode()
     }
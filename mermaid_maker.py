@@ -1,147 +1,163 @@
-import json
-from typing import Dict, List
+import functools
+import io
+import orjson
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, Iterable, TextIO
+
+@functools.lru_cache(maxsize=4096)
+def _norm(s: str) -> str:
+    """Convert an AWS ID into a Mermaid-safe node ID."""
+    return s.replace('-', '_')
 
 class NetworkDiagramGenerator:
     def __init__(self, network_data: Dict):
         self.data = network_data
-        self.diagram = []
+        self._rt_by_subnet = {}
 
     def generate_diagram(self) -> str:
         """Generate complete Mermaid diagram from network data."""
-        self.diagram = ['graph TB']
+        buf = io.StringIO()
+        self.stream_diagram(buf)
+        return buf.getvalue()
+
+    def stream_diagram(self, fp: TextIO) -> None:
+        """Write complete Mermaid diagram from network data to an open text file."""
+        fp.write('graph TB\n')
         
-        # Process each VPC
-        for vpc in self.data['vpcs']:
-            self._process_vpc(vpc)
+        # Process each VPC, across every region for multi-region sweeps
+        if 'regions' in self.data:
+            vpcs = (vpc for region in self.data['regions'] for vpc in region['vpcs'])
+        else:
+            vpcs = self.data['vpcs']
+        for vpc in vpcs:
+            self._process_vpc(vpc, fp)
             
         # Add styling classes
-        self._add_styling()
-        
-        return '\n    '.join(self.diagram)
+        self._add_styling(fp)
 
-    def _process_vpc(self, vpc: Dict) -> None:
+    def _process_vpc(self, vpc: Dict, fp: TextIO) -> None:
         """Process VPC and its components."""
-        vpc_id = vpc['id'].replace('-', '_')
+        write = fp.write
+        vpc_id = _norm(vpc['id'])
+        
+        # Index route tables by associated subnet once per VPC
+        self._rt_by_subnet = defaultdict(list)
+        for rt in vpc['route_tables']:
+            for subnet_id in rt.get('subnet_associations', []):
+                self._rt_by_subnet[subnet_id].append(rt)
         
         # Start VPC subgraph
-        self.diagram.extend([
-            f'    subgraph {vpc_id}["{vpc["name"]} ({vpc["cidr"]})"]'
-        ])
+        write(f'    subgraph {vpc_id}["{vpc["name"]} ({vpc["cidr"]})"]\n')
         
-        # Group subnets by AZ
-        az_subnets = {}
-        for subnet in vpc['subnets']:
-            az = subnet['az']
-            if az not in az_subnets:
-                az_subnets[az] = []
-            az_subnets[az].append(subnet)
+        # Process each AZ, grouping its subnets in a single sorted pass
+        by_az = itemgetter('az')
+        process_az = self._process_az
+        for az, subnets in groupby(sorted(vpc['subnets'], key=by_az), key=by_az):
+            process_az(az, subnets, vpc, fp)
         
-        # Process each AZ
-        for az, subnets in az_subnets.items():
-            self._process_az(az, subnets, vpc)
+        # Security groups belong to the VPC, so emit each one once
+        for sg in vpc['security_groups']:
+            self._add_security_group(sg, fp)
         
-        self.diagram.append('    end')
+        write('    end\n')
         
         # Add Internet Gateway
-        self.diagram.extend([
-            f'    igw_{vpc_id}["Internet Gateway"]'
-        ])
+        igw_node = f'igw_{vpc_id}'
+        write(f'    {igw_node}["Internet Gateway"]\n')
         
         # Connect IGW to public subnets
         for subnet in vpc['subnets']:
             if subnet.get('public'):
-                subnet_id = subnet['id'].replace('-', '_')
-                self.diagram.append(f'    igw_{vpc_id} --> subnet_{subnet_id}')
+                write(f'    {igw_node} --> subnet_{_norm(subnet["id"])}\n')
 
-    def _process_az(self, az: str, subnets: List[Dict], vpc: Dict) -> None:
+    def _process_az(self, az: str, subnets: Iterable[Dict], vpc: Dict, fp: TextIO) -> None:
         """Process Availability Zone and its subnets."""
-        az_id = az.replace('-', '_')
+        write = fp.write
+        az_id = _norm(az)
         
-        self.diagram.extend([
-            f'        subgraph {az_id}["{az}"]'
-        ])
+        write(f'        subgraph {az_id}["{az}"]\n')
         
+        process_subnet = self._process_subnet
         for subnet in subnets:
-            self._process_subnet(subnet, vpc)
+            process_subnet(subnet, vpc, fp)
             
-        self.diagram.append('        end')
+        write('        end\n')
 
-    def _process_subnet(self, subnet: Dict, vpc: Dict) -> None:
+    def _process_subnet(self, subnet: Dict, vpc: Dict, fp: TextIO) -> None:
         """Process subnet and its components."""
-        subnet_id = subnet['id'].replace('-', '_')
+        write = fp.write
+        subnet_node = f'subnet_{_norm(subnet["id"])}'
         subnet_type = "Public" if subnet.get('public') else "Private"
         
-        self.diagram.extend([
-            f'            subgraph subnet_{subnet_id}["{subnet_type} Subnet ({subnet["cidr"]})"]'
-        ])
+        write(f'            subgraph {subnet_node}["{subnet_type} Subnet ({subnet["cidr"]})"]\n')
         
         # Add route tables
-        for rt in vpc['route_tables']:
-            if subnet['id'] in rt.get('subnet_associations', []):
-                self._add_route_table(rt, subnet_id)
-        
-        # Add security groups
-        for sg in vpc['security_groups']:
-            self._add_security_group(sg, subnet_id)
+        for rt in self._rt_by_subnet.get(subnet['id'], ()):
+            self._add_route_table(rt, subnet_node, fp)
             
-        self.diagram.append('            end')
+        write('            end\n')
 
-    def _add_route_table(self, rt: Dict, subnet_id: str) -> None:
+    def _add_route_table(self, rt: Dict, subnet_node: str, fp: TextIO) -> None:
         """Add route table to diagram."""
-        rt_id = rt['id'].replace('-', '_')
+        rt_node = f'rt_{_norm(rt["id"])}'
+        # str.join materializes its argument anyway, so a list comprehension
+        # is cheaper here than a generator expression
         routes_str = '<br/>'.join([
             f"- {route['destination']} → {route['target']}"
             for route in rt['routes']
         ])
         
-        self.diagram.extend([
-            f'                rt_{rt_id}["Route Table<br/>{routes_str}"]',
-            f'                rt_{rt_id} --> subnet_{subnet_id}'
-        ])
+        fp.write(
+            f'                {rt_node}["Route Table<br/>{routes_str}"]\n'
+            f'                {rt_node} --> {subnet_node}\n'
+        )
 
-    def _add_security_group(self, sg: Dict, subnet_id: str) -> None:
+    def _add_security_group(self, sg: Dict, fp: TextIO) -> None:
         """Add security group to diagram."""
-        sg_id = sg['id'].replace('-', '_')
+        sg_node = f'sg_{_norm(sg["id"])}'
+        join_sources = ', '.join
         rules_str = '<br/>'.join([
-            f"- {rule['protocol'].upper()} {rule['port_range']} from {', '.join(rule['sources'])}"
+            f"- {rule['protocol'].upper()} {rule['port_range']} from {join_sources(rule['sources'])}"
             for rule in sg['rules_ingress']
         ])
         
-        self.diagram.extend([
-            f'                sg_{sg_id}["{sg["name"]}<br/>Inbound:<br/>{rules_str}"]',
-            f'                sg_{sg_id} --> subnet_{subnet_id}'
-        ])
+        write = fp.write
+        write(f'        {sg_node}["{sg["name"]}<br/>Inbound:<br/>{rules_str}"]\n')
+        
+        # Connect to the subnets that have interfaces in this group
+        for subnet_id in sg.get('subnets', []):
+            write(f'        {sg_node} --> subnet_{_norm(subnet_id)}\n')
 
-    def _add_styling(self) -> None:
+    def _add_styling(self, fp: TextIO) -> None:
         """Add styling classes to diagram."""
-        self.diagram.extend([
-            '    %% Styling',
-            '    classDef vpc fill:#f5f5f5,stroke:#333,stroke-width:2px',
-            '    classDef az fill:#e6f3ff,stroke:#333,stroke-width:1px',
-            '    classDef subnet fill:#fff,stroke:#333,stroke-width:1px',
-            '    classDef component fill:#fff,stroke:#666,stroke-width:1px,stroke-dasharray: 5 5',
-            '',
-            '    %% Apply styles',
-            '    class vpc vpc',
-            '    class az1 az',
-            '    class pub_subnet,priv_subnet subnet',
-            '    class pub_rt,web_sg,igw component'
-        ])
+        fp.write(
+            '    %% Styling\n'
+            '    classDef vpc fill:#f5f5f5,stroke:#333,stroke-width:2px\n'
+            '    classDef az fill:#e6f3ff,stroke:#333,stroke-width:1px\n'
+            '    classDef subnet fill:#fff,stroke:#333,stroke-width:1px\n'
+            '    classDef component fill:#fff,stroke:#666,stroke-width:1px,stroke-dasharray: 5 5\n'
+            '\n'
+            '    %% Apply styles\n'
+            '    class vpc vpc\n'
+            '    class az1 az\n'
+            '    class pub_subnet,priv_subnet subnet\n'
+            '    class pub_rt,web_sg,igw component\n'
+        )
 
 def main():
     # Sample usage
-    with open('network_data.json', 'r') as f:
-        network_data = json.load(f)
+    with open('network_data.json', 'rb') as f:
+        network_data = orjson.loads(f.read())
     
     generator = NetworkDiagramGenerator(network_data)
-    mermaid_diagram = generator.generate_diagram()
     
-    # Print the diagram
-    print(mermaid_diagram)
-    
-    # Optionally save to file
+    # Stream the diagram straight to file
     with open('network_diagram.mmd', 'w') as f:
-        f.write(mermaid_diagram)
+        generator.stream_diagram(f)
+    
+    print('Diagram written to network_diagram.mmd')
 
 if __name__ == "__main__":
     main()